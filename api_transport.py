@@ -0,0 +1,163 @@
+"""
+Tuned HTTP transport for the Telegram Bot API.
+
+configure_api_transport() replaces telebot's default HTTP layer (a session per thread,
+15s connect / 30s read timeouts, no retries) with one shared keep-alive connection pool,
+separate connect and read timeouts, and retries limited to failures where resending is safe.
+
+PipelinedApiClient optionally sends independent calls (e.g. answerCallbackQuery and the
+follow-up sendMessage) back-to-back on one connection using HTTP/1.1 pipelining, so they
+cost one round trip instead of one each.
+
+Benchmarks against a local stand-in for the Bot API: benchmarks/bench_transport.py
+"""
+import http.client
+import json
+import select
+import threading
+from urllib.parse import urlsplit, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from telebot import apihelper
+
+DEFAULT_API_URL = "https://api.telegram.org/bot{0}/{1}"
+
+# --- Pooled Transport ---
+def create_api_session(pool_size, retries, backoff_factor=0.5):
+    """
+    Returns a requests session with one keep-alive pool of up to pool_size connections.
+    Only failures where Telegram did not execute the call are retried: connection failures (the request
+    never reached it) and 502/503 responses (the gateway could not pass it on). Read timeouts, 500 and 504
+    are not retried: the call may already have been executed, and resending sendMessage would duplicate it.
+    429 is left to telebot, which reports Telegram's retry_after.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        status_forcelist=(502, 503),
+        allowed_methods=None, # Telebot sends GET and POST; both are safe to resend in the cases above
+        backoff_factor=backoff_factor,
+        raise_on_status=False, # Hand the last response to telebot, which raises a proper ApiException
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def configure_api_transport(pool_size, connect_timeout, read_timeout, retries):
+    """Makes every telebot API call use a shared, tuned session. Call before creating the bot."""
+    apihelper.session = create_api_session(pool_size, retries)
+    apihelper.SESSION_TIME_TO_LIVE = None # Keep the shared pool instead of rebuilding sessions every 10 minutes
+    apihelper.CONNECT_TIMEOUT = connect_timeout
+    apihelper.READ_TIMEOUT = read_timeout # getUpdates still uses its own long-polling timeout
+    apihelper.RETRY_ON_ERROR = False # Telebot's own retries also resend after read timeouts
+    return apihelper.session
+
+# --- HTTP/1.1 Pipelining ---
+class _NonClosingReader:
+    """Lets several HTTPResponse objects read one connection's buffered stream in turn."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def makefile(self, *args, **kwargs):
+        return self
+
+    def close(self):
+        pass # HTTPResponse closes its file when a response is finished; the connection stays open
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+class PipelinedApiClient:
+    """
+    Sends independent Bot API calls on one keep-alive connection per thread without waiting
+    for each response (HTTP/1.1 pipelining). Responses are read back in request order.
+    """
+
+    def __init__(self, token, connect_timeout, read_timeout):
+        self.token = token
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.local = threading.local()
+
+    def call_many(self, calls):
+        """
+        Executes [(method_name, params), ...] and returns one entry per call: the call's result,
+        or the exception it failed with (ApiTelegramException for Telegram errors).
+        """
+        urls = [urlsplit((apihelper.API_URL or DEFAULT_API_URL).format(self.token, method)) for method, _ in calls]
+        requests_bytes = b"".join(self._encode_request(url, params) for url, (_, params) in zip(urls, calls))
+        try:
+            connection = self._connection(urls[0])
+            connection.sock.sendall(requests_bytes)
+        except OSError as e:
+            self._reset()
+            return [e] * len(calls)
+
+        results = []
+        for method, _ in calls:
+            try:
+                response = http.client.HTTPResponse(_NonClosingReader(self.local.reader), method="POST")
+                response.begin()
+                result_json = json.loads(response.read())
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                # The connection is unusable; calls without a response may or may not have run
+                self._reset()
+                results.extend([e] * (len(calls) - len(results)))
+                return results
+            if result_json.get("ok"):
+                results.append(result_json.get("result"))
+            else:
+                results.append(apihelper.ApiTelegramException(method, None, result_json))
+            if response.will_close:
+                self._reset()
+                remaining = len(calls) - len(results)
+                results.extend([ConnectionError("Connection closed by the server")] * remaining)
+                return results
+        return results
+
+    def _encode_request(self, url, params):
+        body = urlencode({key: value for key, value in params.items() if value is not None}).encode("utf-8")
+        head = (
+            f"POST {url.path} HTTP/1.1\r\n"
+            f"Host: {url.netloc}\r\n"
+            "Content-Type: application/x-www-form-urlencoded\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: keep-alive\r\n\r\n"
+        )
+        return head.encode("ascii") + body
+
+    def _connection(self, url):
+        """Returns this thread's connection to the API host, reconnecting if the server dropped it while idle."""
+        connection = getattr(self.local, "connection", None)
+        if connection is not None and (self.local.netloc != url.netloc or self._is_dropped(connection)):
+            self._reset()
+            connection = None
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+            connection = connection_class(url.hostname, url.port, timeout=self.connect_timeout)
+            connection.connect()
+            connection.sock.settimeout(self.read_timeout)
+            self.local.connection = connection
+            self.local.netloc = url.netloc
+            self.local.reader = connection.sock.makefile("rb")
+        return connection
+
+    @staticmethod
+    def _is_dropped(connection):
+        # An idle keep-alive socket is only readable if the server closed it (or sent garbage)
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+        return bool(readable)
+
+    def _reset(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            self.local.reader.close()
+            connection.close()
+        self.local.connection = None
@@ -0,0 +1,171 @@
+"""
+Benchmarks Bot API transports against a local stand-in for api.telegram.org.
+
+The stand-in answers every method with {"ok": true}. A TCP proxy in front of it delays traffic in
+each direction by half of --rtt-ms to emulate the network round trip to Telegram.
+
+Scenarios (each one "callback" = answerCallbackQuery + sendMessage):
+  default    telebot's stock transport (session per thread, rebuilt every 10 minutes)
+  pooled     configure_api_transport(): shared keep-alive pool, separate timeouts, retries
+  pipelined  PipelinedApiClient: both calls sent back-to-back on one connection
+
+Usage: python benchmarks/bench_transport.py [--rtt-ms 40] [--callbacks 200] [--threads 1 6]
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telebot import apihelper
+from api_transport import configure_api_transport, PipelinedApiClient
+
+TOKEN = "123456:BENCHMARK"
+
+# --- Stand-in Bot API ---
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like api.telegram.org
+    disable_nagle_algorithm = True # Headers and body are written separately; don't let delayed ACKs stall the body
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with FakeApiHandler.lock:
+            FakeApiHandler.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"ok": True, "result": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+class DelayProxy:
+    """Forwards TCP connections to target, delaying every chunk by one_way_delay seconds."""
+
+    def __init__(self, target_port, one_way_delay):
+        self.target_port = target_port
+        self.one_way_delay = one_way_delay
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for source, destination in ((client, upstream), (upstream, client)):
+                threading.Thread(target=self._pump, args=(source, destination), daemon=True).start()
+
+    def _pump(self, source, destination):
+        # Chunks are released one_way_delay after they arrived, so data already in flight is not delayed twice
+        in_flight = queue.Queue()
+        threading.Thread(target=self._deliver, args=(in_flight, destination), daemon=True).start()
+        try:
+            while True:
+                chunk = source.recv(65536)
+                in_flight.put((time.monotonic() + self.one_way_delay, chunk))
+                if not chunk:
+                    break
+        except OSError:
+            in_flight.put((time.monotonic(), b""))
+
+    def _deliver(self, in_flight, destination):
+        while True:
+            due, chunk = in_flight.get()
+            time.sleep(max(0, due - time.monotonic()))
+            try:
+                if not chunk:
+                    destination.shutdown(socket.SHUT_WR)
+                    return
+                destination.sendall(chunk)
+            except OSError:
+                return
+
+# --- Scenarios ---
+def callback_via_apihelper():
+    apihelper.answer_callback_query(TOKEN, "1", None)
+    apihelper.send_message(TOKEN, 1, "benchmark")
+
+def make_pipelined_callback(client):
+    def callback():
+        for result in client.call_many([("answerCallbackQuery", {"callback_query_id": "1"}),
+                                        ("sendMessage", {"chat_id": 1, "text": "benchmark"})]):
+            if isinstance(result, Exception):
+                raise result
+    return callback
+
+def run_scenario(callback, callbacks, threads):
+    """Runs callbacks spread over fresh threads (telebot caches sessions per thread)."""
+    latencies = []
+    lock = threading.Lock()
+    connections_before = FakeApiHandler.connections
+
+    def worker(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            callback()
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    workers = [threading.Thread(target=worker, args=(callbacks // threads,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "callbacks_per_second": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "connections": FakeApiHandler.connections - connections_before,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=40)
+    parser.add_argument("--callbacks", type=int, default=200)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 6])
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    proxy = DelayProxy(server.server_address[1], args.rtt_ms / 2000)
+    apihelper.API_URL = f"http://127.0.0.1:{proxy.port}/bot{{0}}/{{1}}"
+
+    print(f"{'scenario':<10} {'threads':>7} {'cb/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'conns':>6}")
+    for threads in args.threads:
+        apihelper.session = None # Stock telebot: a new session per thread
+        report("default", threads, run_scenario(callback_via_apihelper, args.callbacks, threads))
+        configure_api_transport(threads + 2, 5, 20, 3)
+        report("pooled", threads, run_scenario(callback_via_apihelper, args.callbacks, threads))
+        pipelined_callback = make_pipelined_callback(PipelinedApiClient(TOKEN, 5, 20))
+        report("pipelined", threads, run_scenario(pipelined_callback, args.callbacks, threads))
+
+def report(name, threads, result):
+    print(f"{name:<10} {threads:>7} {result['callbacks_per_second']:>8.1f} {result['p50_ms']:>8.1f} "
+          f"{result['p95_ms']:>8.1f} {result['connections']:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+"""
+Offline maintenance tool for the bot's data directory.
+
+Runs against bot_data/ without starting the bot or touching the network. Stop the bot first:
+every command that writes replaces files the running bot would otherwise overwrite.
+
+    python maintenance.py export users users.jsonl    # JSON store -> JSON Lines
+    python maintenance.py import users users.jsonl    # JSON Lines -> JSON store
+    python maintenance.py check                       # Report integrity problems
+    python maintenance.py repair                      # Fix the problems check reports (where possible)
+    python maintenance.py compact                     # Drop expired/obsolete entries from the runtime stores
+
+Stores are read and written as streams, one record at a time, so million-user files are processed
+in constant memory. The only exception is the referral check, which keeps the sorted user IDs in
+an 8-byte-per-user array.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone, timedelta
+
+# --- Store Layout (keep in sync with newbot.py) ---
+DEFAULT_DATA_DIR = "bot_data"
+STORES = {
+    # store name -> (file name, top-level JSON type)
+    "users": ("users.json", "object"),
+    "blacklist": ("blacklist.json", "object"),
+    "admins": ("admins.json", "array"),
+}
+STATS_BUCKET_DAYS = 30
+READ_CHUNK_SIZE = 1 << 16
+TEMP_SUFFIX = ".maintenance.tmp"
+
+json_decoder = json.JSONDecoder()
+
+# --- Streaming JSON Reading ---
+def iter_json_container(file_path):
+    """
+    Yields (key, value) for each member of a top-level JSON object, or (index, value) for each
+    element of a top-level JSON array, reading the file in chunks.
+    """
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def fill():
+            # Drops consumed text and reads the next chunk; returns False at end of file
+            nonlocal buffer, position, eof
+            chunk = f.read(READ_CHUNK_SIZE)
+            buffer = buffer[position:] + chunk
+            position = 0
+            if not chunk:
+                eof = True
+            return bool(chunk)
+
+        def skip_whitespace():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n":
+                    position += 1
+                if position < len(buffer) or not fill():
+                    return
+
+        def next_char():
+            skip_whitespace()
+            if position >= len(buffer):
+                raise ValueError(f"Unexpected end of file in {file_path}")
+            return buffer[position]
+
+        def decode_value():
+            # A number cut off by the chunk boundary still decodes ("12" of "123", "-1" of "-1.5"),
+            # so a value only counts as complete if a delimiter follows it
+            nonlocal position
+            skip_whitespace()
+            while True:
+                try:
+                    value, end = json_decoder.raw_decode(buffer, position)
+                    if (end < len(buffer) and buffer[end] in " \t\r\n,:]}") or eof:
+                        position = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        opening = next_char()
+        if opening not in "{[":
+            raise ValueError(f"{file_path} does not contain a JSON object or array")
+        closing = "}" if opening == "{" else "]"
+        position += 1
+        index = 0
+        if next_char() == closing:
+            return
+        while True:
+            if opening == "{":
+                key = decode_value()
+                if next_char() != ":":
+                    raise ValueError(f"Expected ':' after key {key!r} in {file_path}")
+                position += 1
+            else:
+                key = index
+            yield key, decode_value()
+            index += 1
+            separator = next_char()
+            position += 1
+            if separator == closing:
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or '{closing}' in {file_path}")
+
+# --- Streaming JSON Writing ---
+class JsonContainerWriter:
+    """
+    Writes a top-level JSON object or array one member at a time, formatted like the bot's
+    json.dump(data, f, indent=4), to a temporary file that replaces the target on close.
+    """
+
+    def __init__(self, file_path, container_type):
+        self.file_path = file_path
+        self.temp_path = file_path + TEMP_SUFFIX
+        self.is_object = container_type == "object"
+        self.count = 0
+        self.file = open(self.temp_path, 'w', encoding='utf-8')
+        self.file.write("{" if self.is_object else "[")
+
+    def write(self, value, key=None):
+        self.file.write(",\n    " if self.count else "\n    ")
+        if self.is_object:
+            self.file.write(json.dumps(str(key)) + ": ")
+        self.file.write(json.dumps(value, indent=4).replace("\n", "\n    "))
+        self.count += 1
+
+    def close(self):
+        if self.count:
+            self.file.write("\n")
+        self.file.write("}" if self.is_object else "]")
+        self.file.close()
+        os.replace(self.temp_path, self.file_path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+def rewrite_store(file_path, container_type, records):
+    """Streams (key, value) records into file_path, leaving the original untouched if anything fails."""
+    writer = JsonContainerWriter(file_path, container_type)
+    try:
+        for key, value in records:
+            writer.write(value, key)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.count
+
+def store_path(data_dir, store):
+    return os.path.join(data_dir, STORES[store][0])
+
+# --- Import / Export ---
+def export_store(data_dir, store, output_path):
+    """Exports a store to JSON Lines: {"key": ..., "value": ...} per line ("key" omitted for arrays)."""
+    count = 0
+    temp_path = output_path + TEMP_SUFFIX
+    with open(temp_path, 'w', encoding='utf-8') as out:
+        for key, value in iter_json_container(store_path(data_dir, store)):
+            record = {"key": key, "value": value} if STORES[store][1] == "object" else {"value": value}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(temp_path, output_path)
+    print(f"Exported {count} {store} records to {output_path}.")
+
+def iter_json_lines(input_path, container_type):
+    """
+    Yields (key, value) records from a JSON Lines export. For object stores every record needs a numeric
+    "key" and keys must be unique; duplicates are detected once all records are read (keys are kept in a
+    compact array rather than a set), so a bad file still aborts the import before the store is replaced.
+    """
+    keys = array('q')
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                key, value = record.get("key"), record["value"]
+            except (json.JSONDecodeError, KeyError, AttributeError):
+                raise ValueError(f"{input_path}:{line_number}: expected a JSON object with a \"value\" field")
+            if container_type == "object":
+                if not is_numeric_id(key):
+                    raise ValueError(f"{input_path}:{line_number}: expected a numeric user ID string as \"key\", got {key!r}")
+                keys.append(int(key))
+            yield key, value
+    keys = sorted(keys)
+    for previous, current in zip(keys, keys[1:]):
+        if previous == current:
+            raise ValueError(f"{input_path}: duplicate key \"{current}\"")
+
+def import_store(data_dir, store, input_path):
+    """Replaces a store with the records of a JSON Lines file produced by export."""
+    file_path = store_path(data_dir, store)
+    count = rewrite_store(file_path, STORES[store][1], iter_json_lines(input_path, STORES[store][1]))
+    print(f"Imported {count} {store} records into {file_path}.")
+
+# --- Integrity Checks ---
+def is_numeric_id(value):
+    return isinstance(value, str) and value.lstrip("-").isdigit()
+
+def load_user_ids(data_dir):
+    """Returns the sorted numeric user IDs as a compact array, for membership tests by bisection."""
+    user_ids = array('q', (int(key) for key, _ in iter_json_container(store_path(data_dir, "users")) if is_numeric_id(key)))
+    return array('q', sorted(user_ids))
+
+def contains_id(sorted_ids, user_id):
+    index = bisect_left(sorted_ids, user_id)
+    return index < len(sorted_ids) and sorted_ids[index] == user_id
+
+def find_user_problems(user_id, user_data, user_ids):
+    """Returns a list of (problem, fix) pairs for one users.json record; fix is None if it needs a human."""
+    problems = []
+    if not is_numeric_id(user_id):
+        return [(f"user key {user_id!r} is not a numeric Telegram ID", None)]
+    if not isinstance(user_data, dict):
+        return [(f"user {user_id}: record is not an object", None)]
+    for field in ("credits", "referral_count"):
+        value = user_data.get(field, 0)
+        if isinstance(value, int) and not isinstance(value, bool):
+            if value < 0:
+                problems.append((f"user {user_id}: negative {field} ({value})", (field, 0)))
+        elif is_numeric_id(value):
+            # Stored as a string (e.g. "5" from a hand edit): keep the amount, only fix the type
+            problems.append((f"user {user_id}: {field} {value!r} is stored as a string", (field, max(0, int(value)))))
+        elif value is None:
+            problems.append((f"user {user_id}: {field} is null", (field, 0)))
+        else:
+            problems.append((f"user {user_id}: {field} {value!r} is not an integer", None))
+    referred_by = user_data.get("referred_by")
+    if referred_by is not None:
+        if is_numeric_id(referred_by):
+            # Stored as a string: check the ID it names, and keep it (as an int) if it is valid
+            referrer_id = int(referred_by)
+            fix = ("referred_by", referrer_id)
+        elif isinstance(referred_by, int) and not isinstance(referred_by, bool):
+            referrer_id = referred_by
+            fix = None
+        else:
+            problems.append((f"user {user_id}: referred_by {referred_by!r} is not an integer ID", ("referred_by", None)))
+            return problems
+        if referrer_id == int(user_id):
+            problems.append((f"user {user_id}: referred themselves", ("referred_by", None)))
+        elif not contains_id(user_ids, referrer_id):
+            problems.append((f"user {user_id}: dangling referred_by {referrer_id}", ("referred_by", None)))
+        elif fix is not None:
+            problems.append((f"user {user_id}: referred_by {referred_by!r} is stored as a string", fix))
+    return problems
+
+def find_admin_problems(index, admin_id):
+    """Admin IDs must be ints: the bot compares them with the int from_user.id, so "123" never matches."""
+    if isinstance(admin_id, bool) or not isinstance(admin_id, (int, str)):
+        return [(f"admins.json[{index}]: {admin_id!r} is not a user ID", None)]
+    if isinstance(admin_id, str) and not is_numeric_id(admin_id):
+        return [(f"admins.json[{index}]: admin ID {admin_id!r} is not a numeric user ID", None)]
+    if isinstance(admin_id, str):
+        return [(f"admins.json[{index}]: admin ID {admin_id!r} is stored as a string (users.json keys are strings, admin IDs must be ints)", int(admin_id))]
+    return []
+
+def check_stores(data_dir):
+    """Prints every integrity problem found and returns the number of problems."""
+    user_ids = load_user_ids(data_dir)
+    problem_count = 0
+    for user_id, user_data in iter_json_container(store_path(data_dir, "users")):
+        for problem, _ in find_user_problems(user_id, user_data, user_ids):
+            print(problem)
+            problem_count += 1
+    for user_id, _ in iter_json_container(store_path(data_dir, "blacklist")):
+        if not is_numeric_id(user_id):
+            print(f"blacklist key {user_id!r} is not a numeric Telegram ID")
+            problem_count += 1
+    seen_admins = set() # admins.json is a short list
+    for index, admin_id in iter_json_container(store_path(data_dir, "admins")):
+        for problem, _ in find_admin_problems(index, admin_id):
+            print(problem)
+            problem_count += 1
+        if admin_id in seen_admins:
+            print(f"admins.json[{index}]: duplicate admin ID {admin_id!r}")
+            problem_count += 1
+        seen_admins.add(admin_id)
+    print(f"Checked {len(user_ids)} users: {problem_count} problem(s) found.")
+    return problem_count
+
+# --- Bulk Repair ---
+def repair_stores(data_dir):
+    """Rewrites the stores with every automatically fixable problem fixed, and reports the rest."""
+    user_ids = load_user_ids(data_dir)
+    fixed = 0
+    unfixable = 0
+
+    def repaired_users():
+        nonlocal fixed, unfixable
+        for user_id, user_data in iter_json_container(store_path(data_dir, "users")):
+            for problem, fix in find_user_problems(user_id, user_data, user_ids):
+                if fix is None:
+                    print(f"Cannot repair automatically: {problem}")
+                    unfixable += 1
+                else:
+                    field, value = fix
+                    user_data[field] = value
+                    fixed += 1
+            yield user_id, user_data
+
+    def repaired_admins():
+        nonlocal fixed, unfixable
+        seen_admins = set()
+        for index, admin_id in iter_json_container(store_path(data_dir, "admins")):
+            for problem, fix in find_admin_problems(index, admin_id):
+                if fix is None:
+                    print(f"Cannot repair automatically: {problem}")
+                    unfixable += 1
+                else:
+                    admin_id = fix
+                    fixed += 1
+            if admin_id in seen_admins:
+                fixed += 1 # Duplicate dropped
+                continue
+            seen_admins.add(admin_id)
+            yield None, admin_id
+
+    for user_id, _ in iter_json_container(store_path(data_dir, "blacklist")):
+        if not is_numeric_id(user_id):
+            print(f"Cannot repair automatically: blacklist key {user_id!r} is not a numeric Telegram ID")
+            unfixable += 1
+    if os.path.exists(store_path(data_dir, "users")):
+        rewrite_store(store_path(data_dir, "users"), "object", repaired_users())
+    if os.path.exists(store_path(data_dir, "admins")):
+        rewrite_store(store_path(data_dir, "admins"), "array", repaired_admins())
+    print(f"Repaired {fixed} problem(s); {unfixable} need manual attention.")
+    return unfixable
+
+# --- Compaction ---
+def compact_stores(data_dir):
+    """Drops entries the bot no longer needs from its runtime stores and removes leftover temp files."""
+    now = time.time()
+
+    conversations_path = os.path.join(data_dir, "conversations.json")
+    if os.path.exists(conversations_path):
+        kept = rewrite_store(conversations_path, "object",
+                             ((chat_id, entry) for chat_id, entry in iter_json_container(conversations_path)
+                              if entry.get("expires_at", 0) > now))
+        print(f"conversations.json: kept {kept} active flow(s).")
+
+    stats_path = os.path.join(data_dir, "stats.json")
+    if os.path.exists(stats_path):
+        with open(stats_path, 'r', encoding='utf-8') as f:
+            stats = json.load(f) # A few dozen daily buckets
+        oldest_kept = (datetime.now(timezone.utc) - timedelta(days=STATS_BUCKET_DAYS - 1)).strftime("%Y-%m-%d")
+        daily = stats.get("daily", {})
+        stats["daily"] = {day: bucket for day, bucket in daily.items() if day >= oldest_kept}
+        rewrite_store(stats_path, "object", stats.items())
+        print(f"stats.json: dropped {len(daily) - len(stats['daily'])} daily bucket(s) older than {STATS_BUCKET_DAYS} days.")
+
+    state_path = os.path.join(data_dir, "state.json")
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        # Telegram never redelivers updates at or below the confirmed offset, so their IDs are not needed
+        recent = state.get("recent_update_ids", [])
+        state["recent_update_ids"] = [update_id for update_id in recent if update_id > state.get("last_update_id", 0)]
+        rewrite_store(state_path, "object", state.items())
+        print(f"state.json: dropped {len(recent) - len(state['recent_update_ids'])} update ID(s) below the saved offset.")
+
+    for file_name in os.listdir(data_dir):
+        if file_name.endswith(".tmp"):
+            os.remove(os.path.join(data_dir, file_name))
+            print(f"Removed leftover temporary file {file_name}.")
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline maintenance for the bot's data directory. Stop the bot before writing.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help=f"data directory (default: {DEFAULT_DATA_DIR})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="export a store to JSON Lines")
+    export_parser.add_argument("store", choices=sorted(STORES))
+    export_parser.add_argument("output")
+    import_parser = commands.add_parser("import", help="replace a store with a JSON Lines file")
+    import_parser.add_argument("store", choices=sorted(STORES))
+    import_parser.add_argument("input")
+    commands.add_parser("check", help="report integrity problems")
+    commands.add_parser("repair", help="fix integrity problems where possible")
+    commands.add_parser("compact", help="drop expired and obsolete entries from the runtime stores")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.data_dir):
+        print(f"Data directory {args.data_dir} does not exist.")
+        return 2
+    try:
+        if args.command == "export":
+            export_store(args.data_dir, args.store, args.output)
+        elif args.command == "import":
+            import_store(args.data_dir, args.store, args.input)
+        elif args.command == "check":
+            return 1 if check_stores(args.data_dir) else 0
+        elif args.command == "repair":
+            return 1 if repair_stores(args.data_dir) else 0
+        elif args.command == "compact":
+            compact_stores(args.data_dir)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
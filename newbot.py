@@ -2,7 +2,16 @@ import requests
 import time
 import json
 import os
-from random import randint
+import re
+import signal
+from datetime import datetime, timezone, timedelta
+import csv
+import io
+import threading
+from bisect import bisect_left, insort
+from collections import deque, OrderedDict
+from random import randint, uniform
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 try:
     import telebot
@@ -11,6 +20,8 @@ except ModuleNotFoundError:
     input("There is no necessary library. Complete the command line command: PIP Install Pytelegrambotapi")
     exit() # Exit if telebot is not found, as the bot cannot function without it
 
+from api_transport import configure_api_transport, PipelinedApiClient # Local module, shipped next to this file
+
 # --- Configuration ---
 # Your bot and API tokens
 url = "https://leakosintapi.com/"
@@ -36,6 +47,71 @@ GROUP_ID = int(os.getenv("GROUP_ID", "0")) # <<<--- YOUR ACTUAL GROUP CHAT ID HA
 INITIAL_FREE_CREDITS = 2  # Number of free credits for new users
 REFERRALS_FOR_CREDIT = 3  # Number of referrals needed for 1 credit reward
 
+# Update execution capacity. General workers serve every update (fast ones first),
+# reserved workers only ever serve fast updates (menu buttons, commands, callbacks, admins).
+GENERAL_WORKER_THREADS = int(os.getenv("GENERAL_WORKER_THREADS", "4"))
+FAST_WORKER_THREADS = int(os.getenv("FAST_WORKER_THREADS", "2"))
+
+# Shutdown: the platform sends SIGTERM and kills the process 30 seconds later.
+# The long poll is kept shorter than that so polling stops promptly, and in-flight
+# handlers get SHUTDOWN_DRAIN_SECONDS (counted from the signal) to finish.
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "10"))
+SHUTDOWN_DRAIN_SECONDS = int(os.getenv("SHUTDOWN_DRAIN_SECONDS", "25"))
+
+# Multi-step admin flows (e.g. "Add Admin" waiting for a user ID) expire after this many seconds,
+# and at most MAX_CONVERSATIONS chats can be in a flow at once (the oldest is dropped first).
+CONVERSATION_TTL_SECONDS = int(os.getenv("CONVERSATION_TTL_SECONDS", "600"))
+MAX_CONVERSATIONS = int(os.getenv("MAX_CONVERSATIONS", "1000"))
+
+# Search results are kept for pagination for this many seconds, then swept from memory
+REPORT_TTL_SECONDS = int(os.getenv("REPORT_TTL_SECONDS", "3600"))
+CACHE_SWEEP_INTERVAL_SECONDS = 300
+
+# Admin statistics: daily counters are kept for this many days and saved every STATS_ROLLUP_INTERVAL_SECONDS
+STATS_BUCKET_DAYS = 30
+STATS_ROLLUP_INTERVAL_SECONDS = 60
+
+# Number of recently processed update IDs remembered (and persisted) to skip redelivered updates.
+# While a slow handler holds the poll offset back, getUpdates returns up to 100 updates after it again,
+# so the window must hold at least that many.
+DEDUP_WINDOW = max(100, int(os.getenv("DEDUP_WINDOW", "2000")))
+# Polls that only return updates still held back by a slow handler are repeated after this many seconds
+HELD_BACK_POLL_INTERVAL_SECONDS = 1
+# Upstream search requests are abandoned (and the credit refunded) after this many seconds,
+# which also bounds how long a search can hold the poll offset back
+SEARCH_TIMEOUT_SECONDS = int(os.getenv("SEARCH_TIMEOUT_SECONDS", "60"))
+
+LEADERBOARD_SIZE = 10 # Entries shown by /leaderboard
+ADMIN_LEADERBOARD_SIZE = 25 # Entries shown in the admin panel view
+
+# Admin audit log: entries are buffered in memory and appended to disk in batches by a scheduled job.
+# The file is rotated at AUDIT_LOG_MAX_BYTES, keeping AUDIT_LOG_BACKUPS old files (audit.log.1 is the newest).
+AUDIT_LOG_MAX_BYTES = 1024 * 1024
+AUDIT_LOG_BACKUPS = 5
+AUDIT_FLUSH_INTERVAL_SECONDS = 2
+AUDIT_RECENT_ENTRIES = 500 # Kept in memory for /audit
+AUDIT_PAGE_SIZE = 10
+
+# Polling supervisor: after a failed getUpdates call (network error, Telegram 5xx/429/409/401), wait a
+# jittered exponential backoff (POLL_BACKOFF_BASE_SECONDS doubling up to POLL_BACKOFF_MAX_SECONDS).
+# The watchdog abandons a poll attempt that has not returned (successfully or not) within
+# WATCHDOG_STALL_SECONDS and starts a new one, and exits (so the platform restarts the dyno) if that did not help.
+POLL_BACKOFF_BASE_SECONDS = 1
+POLL_BACKOFF_MAX_SECONDS = 300
+WATCHDOG_STALL_SECONDS = int(os.getenv("WATCHDOG_STALL_SECONDS", "120"))
+# Health/readiness endpoint (GET /health, GET /ready). Set HEALTH_PORT=0 to disable.
+HEALTH_HOST = os.getenv("HEALTH_HOST", "127.0.0.1")
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8080"))
+
+# Bot API transport: one shared keep-alive pool, a short connect timeout (fail fast when Telegram is
+# unreachable) and a longer read timeout for slow sends. Connection failures and 502/503 responses
+# (the call never reached Telegram) are retried up to API_RETRIES times. ENABLE_PIPELINING=1 sends a
+# callback's answer and its follow-up message back-to-back on one connection (one round trip instead of two).
+API_CONNECT_TIMEOUT = int(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT = int(os.getenv("API_READ_TIMEOUT", "20"))
+API_RETRIES = int(os.getenv("API_RETRIES", "3"))
+ENABLE_PIPELINING = os.getenv("ENABLE_PIPELINING", "0") == "1"
+
 # --- JSON File Paths for Persistent Data ---
 # We will store user data, blacklisted users, and additional admin IDs in JSON files.
 # It's good practice to keep them in a dedicated directory.
@@ -43,6 +119,10 @@ DATA_DIR = "bot_data"
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
 BLACKLIST_FILE = os.path.join(DATA_DIR, "blacklist.json")
 ADMINS_FILE = os.path.join(DATA_DIR, "admins.json") # New file for additional admins
+STATE_FILE = os.path.join(DATA_DIR, "state.json") # Bot runtime state (e.g. last processed update offset)
+CONVERSATIONS_FILE = os.path.join(DATA_DIR, "conversations.json") # In-progress multi-step flows, keyed by chat ID
+STATS_FILE = os.path.join(DATA_DIR, "stats.json") # Event counters for the admin statistics dashboard
+AUDIT_LOG_FILE = os.path.join(DATA_DIR, "audit.log") # Append-only log of admin actions, one JSON object per line
 
 # Ensure the data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -53,6 +133,7 @@ users_data = {}
 blacklisted_users = {}
 additional_admins = [] # New list to store additional admin user IDs
 cash_reports = {} # Still for temporary reports (not persistent across bot restarts)
+cash_report_times = {} # query_id -> creation time, used to sweep old reports
 
 # --- JSON File Helper Functions ---
 def load_data(file_path):
@@ -64,21 +145,52 @@ def load_data(file_path):
             except json.JSONDecodeError:
                 print(f"Error decoding JSON from {file_path}. Returning empty.")
                 # Return appropriate empty type based on expected content
-                return {} if "users" in file_path or "blacklist" in file_path else []
+                return [] if file_path == ADMINS_FILE else {}
     # Return appropriate empty type if file doesn't exist
-    return {} if "users" in file_path or "blacklist" in file_path else []
+    return [] if file_path == ADMINS_FILE else {}
+
 
+# Handlers run on several worker threads, so file writes are serialized to avoid interleaved dumps.
+data_lock = threading.RLock()
 
 def save_data(data, file_path):
     """Saves data to a JSON file."""
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4)
+    with data_lock:
+        # Write to a temporary file and swap it in, so a process killed mid-write never leaves a truncated file
+        temp_path = file_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+        os.replace(temp_path, file_path)
+
+def commit_data(data, file_path):
+    """Saves a store changed by the update being handled; the update offset is saved once its handler finishes."""
+    with data_lock:
+        save_data(data, file_path)
+        current_update.changed_store = True
+
+def flush_data():
+    """Saves every in-memory store to disk under the data lock."""
+    with data_lock:
+        save_data(users_data, USERS_FILE)
+        save_data(blacklisted_users, BLACKLIST_FILE)
+        save_data(additional_admins, ADMINS_FILE)
+        save_data(conversation_states, CONVERSATIONS_FILE)
+        save_data(stats_events, STATS_FILE)
+        bot_state.update(processed_updates.to_state())
+        save_data(bot_state, STATE_FILE)
 
 # --- Initial Data Loading ---
 # Load existing data when the bot starts
 users_data = load_data(USERS_FILE)
 blacklisted_users = load_data(BLACKLIST_FILE)
 additional_admins = load_data(ADMINS_FILE) # Load additional admin IDs
+bot_state = load_data(STATE_FILE)
+# Event counters ("totals" all-time, "daily" per UTC day) that cannot be derived from users.json
+stats_events = load_data(STATS_FILE)
+stats_events.setdefault("totals", {})
+stats_events.setdefault("daily", {})
+# Ordered by last update; since every flow has the same TTL, the front is always the next to expire
+conversation_states = OrderedDict(sorted(load_data(CONVERSATIONS_FILE).items(), key=lambda item: item[1]["expires_at"]))
 print(f"Loaded {len(users_data)} users, {len(blacklisted_users)} blacklisted users, and {len(additional_admins)} additional admins from JSON files.")
 
 # --- Data Management Functions (using JSON files) ---
@@ -88,8 +200,36 @@ def get_user_data(user_id):
 
 def set_user_data(user_id, data):
     """Sets or updates user data in in-memory dictionary and saves to file."""
-    users_data[str(user_id)] = data
-    save_data(users_data, USERS_FILE)
+    with data_lock:
+        track_user_stats(user_id, data)
+        users_data[str(user_id)] = data
+        commit_data(users_data, USERS_FILE)
+
+def charge_search_credit(user_id, user_data):
+    """
+    Deducts one credit for the search in the update being handled. The charged update_id is stored
+    with the credits, so a search redelivered after a crash runs again without being charged twice.
+    Returns False if the user has no credits left.
+    """
+    update_id = getattr(current_update, "update_id", None)
+    with data_lock:
+        if update_id is not None and user_data.get("charged_update_id") == update_id:
+            return True # Already charged before the interruption
+        if user_data.get("credits", 0) <= 0:
+            return False
+        user_data["credits"] -= 1
+        user_data["charged_update_id"] = update_id
+        set_user_data(user_id, user_data)
+    record_stat_event("credits_spent")
+    return True
+
+def refund_search_credit(user_id, user_data):
+    """Gives back the credit charged for the search in the update being handled."""
+    with data_lock:
+        user_data["credits"] += 1
+        user_data.pop("charged_update_id", None)
+        set_user_data(user_id, user_data)
+    record_stat_event("credits_refunded")
 
 def is_user_blacklisted(user_id):
     """Checks if a user is blacklisted from in-memory dictionary."""
@@ -98,19 +238,19 @@ def is_user_blacklisted(user_id):
 def blacklist_user(user_id):
     """Blacklists a user by adding to in-memory dictionary and saving to file."""
     blacklisted_users[str(user_id)] = True # Store a simple indicator
-    save_data(blacklisted_users, BLACKLIST_FILE)
+    commit_data(blacklisted_users, BLACKLIST_FILE)
 
 def unblacklist_user(user_id):
     """Unblacklists a user by removing from in-memory dictionary and saving to file."""
     if str(user_id) in blacklisted_users:
         del blacklisted_users[str(user_id)]
-        save_data(blacklisted_users, BLACKLIST_FILE)
+        commit_data(blacklisted_users, BLACKLIST_FILE)
 
 def add_admin(user_id):
     """Adds a user to the additional_admins list and saves."""
     if user_id not in additional_admins:
         additional_admins.append(user_id)
-        save_data(additional_admins, ADMINS_FILE)
+        commit_data(additional_admins, ADMINS_FILE)
         return True
     return False
 
@@ -118,24 +258,757 @@ def remove_admin(user_id):
     """Removes a user from the additional_admins list and saves."""
     if user_id in additional_admins:
         additional_admins.remove(user_id)
-        save_data(additional_admins, ADMINS_FILE)
+        commit_data(additional_admins, ADMINS_FILE)
         return True
     return False
 
+# --- Bulk Admin Operations ---
+# Each bulk helper applies all rows under the data lock and saves the file once,
+# returning (applied, failed) where failed is a list of (row, reason) pairs.
+def parse_bulk_rows(text):
+    """Parses CSV text into rows of stripped cells, skipping blank lines and a header row."""
+    rows = [[cell.strip() for cell in row] for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    if rows and not rows[0][0].lstrip("-").isdigit():
+        rows = rows[1:] # e.g. "user_id,credits"
+    return rows
+
+def bulk_set_credits(rows, default_amount=None):
+    """Sets credits for many users in one batch. Rows are [user_id, amount] or [user_id] with default_amount."""
+    applied, failed = [], []
+    with data_lock:
+        for row in rows:
+            try:
+                target_user_id = int(row[0])
+                amount = int(row[1]) if len(row) > 1 and row[1] else int(default_amount)
+            except (ValueError, TypeError, IndexError):
+                failed.append((",".join(row), "invalid user ID or amount"))
+                continue
+            target_user_data = users_data.get(str(target_user_id))
+            if target_user_data is None:
+                failed.append((str(target_user_id), "user not found"))
+                continue
+            target_user_data["credits"] = amount
+            track_user_stats(target_user_id, target_user_data)
+            applied.append(target_user_id)
+        if applied:
+            commit_data(users_data, USERS_FILE)
+    return applied, failed
+
+def bulk_set_blacklisted(rows, blacklisted):
+    """Blacklists (or unblacklists) many users in one batch. Rows are [user_id, ...]."""
+    applied, failed = [], []
+    with data_lock:
+        for row in rows:
+            try:
+                target_user_id = int(row[0])
+            except (ValueError, IndexError):
+                failed.append((",".join(row), "invalid user ID"))
+                continue
+            if blacklisted:
+                blacklisted_users[str(target_user_id)] = True
+            elif blacklisted_users.pop(str(target_user_id), None) is None:
+                failed.append((str(target_user_id), "not blacklisted"))
+                continue
+            applied.append(target_user_id)
+        if applied:
+            commit_data(blacklisted_users, BLACKLIST_FILE)
+    return applied, failed
+
+# --- Conversation State Store ---
+def set_conversation_state(chat_id, state, data=None):
+    """Starts or advances a multi-step flow for a chat and saves the store."""
+    now = time.time()
+    with data_lock:
+        conversation_states[str(chat_id)] = {"state": state, "data": data or {}, "expires_at": now + CONVERSATION_TTL_SECONDS}
+        conversation_states.move_to_end(str(chat_id))
+        # Drop expired flows from the front, then the oldest ones if the store is over its cap
+        while conversation_states:
+            oldest = next(iter(conversation_states.values()))
+            if oldest["expires_at"] > now and len(conversation_states) <= MAX_CONVERSATIONS:
+                break
+            conversation_states.popitem(last=False)
+        save_data(conversation_states, CONVERSATIONS_FILE)
+
+def get_conversation_state(chat_id):
+    """Returns the active flow for a chat, or None if there is none or it has expired."""
+    entry = conversation_states.get(str(chat_id))
+    if entry is None:
+        return None
+    if entry["expires_at"] <= time.time():
+        clear_conversation_state(chat_id)
+        return None
+    return entry
+
+def clear_conversation_state(chat_id):
+    """Ends the flow for a chat and saves the store."""
+    with data_lock:
+        if conversation_states.pop(str(chat_id), None) is not None:
+            save_data(conversation_states, CONVERSATIONS_FILE)
+
+# --- Statistics ---
+# Aggregates for the admin dashboard are updated on every user mutation instead of scanning users_data.
+# Handlers mutate user dicts in place before calling set_user_data, so the last seen (credits, referrals)
+# of each user is kept to compute the change.
+user_stat_snapshot = {}
+stats_aggregates = {"outstanding_credits": 0, "total_referrals": 0}
+
+def stats_day_key(days_ago=0):
+    """Returns the UTC date key of a daily stats bucket."""
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+
+def record_stat_event(name, amount=1):
+    """Adds to an all-time event counter and to today's bucket."""
+    with data_lock:
+        stats_events["totals"][name] = stats_events["totals"].get(name, 0) + amount
+        bucket = stats_events["daily"].setdefault(stats_day_key(), {})
+        bucket[name] = bucket.get(name, 0) + amount
+
+def track_user_stats(user_id, data):
+    """Applies the change between a user's last seen record and their new one to the aggregates."""
+    key = str(user_id)
+    credits = data.get("credits", 0)
+    referrals = data.get("referral_count", 0)
+    with data_lock:
+        if key not in user_stat_snapshot:
+            record_stat_event("new_users")
+        old_credits, old_referrals = user_stat_snapshot.get(key, (0, 0))
+        stats_aggregates["outstanding_credits"] += credits - old_credits
+        stats_aggregates["total_referrals"] += referrals - old_referrals
+        if referrals > old_referrals:
+            record_stat_event("referrals", referrals - old_referrals)
+        if referrals != old_referrals:
+            referral_leaderboard.update(key, referrals)
+        user_stat_snapshot[key] = (credits, referrals)
+
+def roll_up_stats():
+    """Drops daily buckets older than STATS_BUCKET_DAYS and saves the counters."""
+    oldest_kept = stats_day_key(STATS_BUCKET_DAYS - 1)
+    with data_lock:
+        for day in [day for day in stats_events["daily"] if day < oldest_kept]:
+            del stats_events["daily"][day]
+        save_data(stats_events, STATS_FILE)
+
+def get_stats_summary():
+    """Returns the dashboard figures in O(1)."""
+    totals = stats_events["totals"]
+    today = stats_events["daily"].get(stats_day_key(), {})
+    spent = totals.get("credits_spent", 0)
+    refunded = totals.get("credits_refunded", 0)
+    return {
+        "total_users": len(users_data),
+        "new_users_today": today.get("new_users", 0),
+        "outstanding_credits": stats_aggregates["outstanding_credits"],
+        "credits_spent": spent,
+        "credits_spent_today": today.get("credits_spent", 0),
+        "credits_refunded": refunded,
+        "credits_refunded_today": today.get("credits_refunded", 0),
+        "refund_ratio": refunded / spent if spent else 0.0,
+        "blacklisted": len(blacklisted_users),
+        "total_referrals": stats_aggregates["total_referrals"],
+        "referrals_today": today.get("referrals", 0),
+    }
+
+# --- Referral Leaderboard ---
+class ReferralLeaderboard:
+    """
+    Order-statistic index over referral counts, updated on every referral change.
+    A Fenwick tree counts users per referral_count, so a user's rank and the position of
+    the k-th referrer are found in O(log max_count); users with the same count share a bucket,
+    kept sorted by user ID so top-k reads only the entries it returns. Users with no referrals are not ranked.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.user_counts = {} # user_id (str) -> referral_count
+        self.buckets = {} # referral_count -> sorted list of int user_ids
+        self.capacity = 64 # Largest referral_count the tree can hold; doubled as needed
+        self.tree = [0] * (self.capacity + 1)
+        self.total = 0 # Number of ranked users
+
+    def update(self, user_id, referral_count):
+        """Moves a user to their new referral count."""
+        with self.lock:
+            old_count = self.user_counts.get(user_id, 0)
+            if old_count == referral_count:
+                return
+            if old_count > 0:
+                self._add(old_count, -1)
+                bucket = self.buckets[old_count]
+                del bucket[bisect_left(bucket, int(user_id))]
+                if not bucket:
+                    del self.buckets[old_count]
+                self.total -= 1
+            if referral_count > 0:
+                while referral_count > self.capacity:
+                    self._grow()
+                self._add(referral_count, 1)
+                insort(self.buckets.setdefault(referral_count, []), int(user_id))
+                self.user_counts[user_id] = referral_count
+                self.total += 1
+            else:
+                self.user_counts.pop(user_id, None)
+
+    def rank(self, user_id):
+        """Returns (rank, ranked users) for a user, or (None, ranked users) if they have no referrals."""
+        with self.lock:
+            count = self.user_counts.get(str(user_id))
+            if not count:
+                return None, self.total
+            # Rank = 1 + number of users with strictly more referrals
+            return self.total - self._prefix_sum(count) + 1, self.total
+
+    def top(self, k):
+        """Returns up to k (rank, user_id, referral_count) tuples, highest first. Ties are ordered by user ID."""
+        with self.lock:
+            entries = []
+            position = 1 # Position from the top of the first user in the next bucket
+            while len(entries) < k and position <= self.total:
+                count = self._find_by_order(self.total - position + 1)
+                bucket = self.buckets[count]
+                for user_id in bucket[:k - len(entries)]:
+                    entries.append((position, str(user_id), count))
+                position += len(bucket)
+            return entries
+
+    def _add(self, index, delta):
+        while index <= self.capacity:
+            self.tree[index] += delta
+            index += index & -index
+
+    def _prefix_sum(self, index):
+        """Number of ranked users with referral_count <= index."""
+        result = 0
+        while index > 0:
+            result += self.tree[index]
+            index -= index & -index
+        return result
+
+    def _find_by_order(self, order):
+        """Smallest referral_count c such that at least `order` users have a count <= c."""
+        index = 0
+        step = 1 << self.capacity.bit_length()
+        while step:
+            next_index = index + step
+            if next_index <= self.capacity and self.tree[next_index] < order:
+                index = next_index
+                order -= self.tree[index]
+            step >>= 1
+        return index + 1
+
+    def _grow(self):
+        self.capacity *= 2
+        self.tree = [0] * (self.capacity + 1)
+        for count, bucket in self.buckets.items():
+            self._add(count, len(bucket))
+
+referral_leaderboard = ReferralLeaderboard()
+
+# One scan at startup seeds the aggregates and the leaderboard; existing users are not counted as new
+for seed_user_id, seed_user_data in users_data.items():
+    user_stat_snapshot[seed_user_id] = (seed_user_data.get("credits", 0), seed_user_data.get("referral_count", 0))
+    stats_aggregates["outstanding_credits"] += seed_user_data.get("credits", 0)
+    stats_aggregates["total_referrals"] += seed_user_data.get("referral_count", 0)
+    referral_leaderboard.update(seed_user_id, seed_user_data.get("referral_count", 0))
+
+# --- Admin Audit Log ---
+class AuditLog:
+    """
+    Append-only, size-rotated log of admin mutations.
+    record() only appends to in-memory queues, so admin handlers never wait on disk;
+    flush() writes the pending batch and runs on the scheduler (and at shutdown).
+    """
+
+    def __init__(self, file_path, max_bytes, backup_count, recent_size):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.pending = deque() # Entries not yet written
+        self.recent = deque(maxlen=recent_size) # Newest entries, for paging without reading the file
+        self.write_lock = threading.Lock()
+        if os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.recent.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass # A line cut short by a crash
+
+    def record(self, admin_id, action, target=None, **details):
+        """Queues an entry for an admin action."""
+        entry = {
+            "time": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC"),
+            "admin_id": admin_id,
+            "action": action,
+            "target": target,
+        }
+        entry.update(details)
+        self.pending.append(entry)
+        self.recent.append(entry)
+
+    def flush(self):
+        """Appends all pending entries to the log file in one write, rotating it first if it is full."""
+        with self.write_lock:
+            entries = []
+            while self.pending:
+                entries.append(self.pending.popleft())
+            if not entries:
+                return
+            try:
+                if os.path.exists(self.file_path) and os.path.getsize(self.file_path) >= self.max_bytes:
+                    self._rotate()
+                with open(self.file_path, 'a', encoding='utf-8') as f:
+                    f.write("\n".join(json.dumps(entry, ensure_ascii=False) for entry in entries) + "\n")
+            except OSError as e:
+                # Put the batch back in front of entries recorded meanwhile; the next flush retries it
+                self.pending.extendleft(reversed(entries))
+                print(f"Error writing audit log ({len(entries)} entries kept for retry): {e}")
+
+    def _rotate(self):
+        # audit.log.4 -> audit.log.5, ..., audit.log -> audit.log.1; the oldest file is dropped
+        for index in range(self.backup_count - 1, 0, -1):
+            older = f"{self.file_path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.file_path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.file_path, f"{self.file_path}.1")
+        else:
+            os.remove(self.file_path)
+
+    def page(self, page_number, page_size):
+        """
+        Returns (entries, page number, page count) for a 1-based page of recent entries, newest first.
+        Out-of-range page numbers are clamped to the first or last page.
+        """
+        entries = list(self.recent)
+        entries.reverse()
+        page_count = max(1, -(-len(entries) // page_size))
+        page_number = min(max(page_number, 1), page_count)
+        start = (page_number - 1) * page_size
+        return entries[start:start + page_size], page_number, page_count
+
+audit_log = AuditLog(AUDIT_LOG_FILE, AUDIT_LOG_MAX_BYTES, AUDIT_LOG_BACKUPS, AUDIT_RECENT_ENTRIES)
+
 def is_admin_user(user_id):
     """Checks if a user is the primary admin or an added admin."""
     return user_id == ADMIN_USER_ID or user_id in additional_admins
 
 # --- Bot Initialization ---
+# Every worker thread plus the poller and the scheduler can hold a connection at once
+configure_api_transport(GENERAL_WORKER_THREADS + FAST_WORKER_THREADS + 2, API_CONNECT_TIMEOUT, API_READ_TIMEOUT, API_RETRIES)
 bot = telebot.TeleBot(bot_token)
+api_pipeline = PipelinedApiClient(bot_token, API_CONNECT_TIMEOUT, API_READ_TIMEOUT) if ENABLE_PIPELINING else None
+
+def answer_and_send(call, text, callback_text=None, **send_kwargs):
+    """Acknowledges a callback query and sends a message to its chat, pipelined when enabled."""
+    if api_pipeline is None:
+        bot.send_message(call.message.chat.id, text, **send_kwargs)
+        bot.answer_callback_query(call.id, callback_text)
+        return
+    reply_markup = send_kwargs.pop("reply_markup", None)
+    results = api_pipeline.call_many([
+        ("answerCallbackQuery", {"callback_query_id": call.id, "text": callback_text}),
+        ("sendMessage", {"chat_id": call.message.chat.id, "text": text,
+                         "reply_markup": reply_markup.to_json() if reply_markup else None, **send_kwargs}),
+    ])
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
 
 # Determine the bot's actual username for referral links
 try:
     BOT_USERNAME = bot.get_me().username
-except telebot.apihelper.ApiTelegramException as e:
+except (telebot.apihelper.ApiTelegramException, requests.exceptions.RequestException) as e: # Also tolerate a Telegram outage at startup
     print(f"Error getting bot username: {e}. Please ensure your bot token is correct and bot is enabled.")
     BOT_USERNAME = "your_bot_username_placeholder" # Fallback in case of error
 
+# --- Idempotent Update Processing ---
+# Telegram redelivers every update past the offset confirmed by the last getUpdates call. Polls confirm
+# only up to safe_offset(), the last update before the oldest unfinished one, so an update whose handler
+# is interrupted (drain timeout, crash) is redelivered and run again. Handlers with side effects that must
+# not repeat are idempotent themselves (see charge_search_credit). Updates after the offset that are
+# fetched again are skipped: in-flight ones, and processed ones recorded in the index. An update is
+# recorded as processed when its handler finishes, and the update state is saved then if the handler
+# changed a store (see commit_data). Only the last DEDUP_WINDOW IDs are kept.
+current_update = threading.local() # update_id of the update being handled on this worker thread
+
+class ProcessedUpdateIndex:
+    """
+    Bounded index of recently processed update IDs (ring buffer plus set, O(1) lookups),
+    with tracking of in-flight updates to compute the offset that is safe to resume from.
+    """
+
+    def __init__(self, capacity, last_update_id=0, recent_update_ids=()):
+        self.lock = threading.Lock()
+        self.ring = deque(maxlen=capacity)
+        self.seen = set()
+        self.in_flight = {} # update_id -> number of queued handler tasks
+        self.dropped = set() # Updates the draining worker pool rejected; never marked processed
+        self.highest_received = last_update_id
+        for update_id in recent_update_ids:
+            self._mark_processed(update_id)
+
+    def is_duplicate(self, update_id):
+        with self.lock:
+            return update_id in self.seen or update_id in self.in_flight
+
+    def received(self, update_id):
+        with self.lock:
+            self.in_flight[update_id] = 0
+            self.highest_received = max(self.highest_received, update_id)
+
+    def task_queued(self, update_id):
+        with self.lock:
+            if update_id in self.in_flight:
+                self.in_flight[update_id] += 1
+
+    def task_done(self, update_id):
+        with self.lock:
+            if update_id in self.in_flight:
+                self.in_flight[update_id] -= 1
+                if self.in_flight[update_id] <= 0:
+                    del self.in_flight[update_id]
+                    if update_id not in self.dropped:
+                        self._mark_processed(update_id)
+
+    def task_dropped(self, update_id):
+        """Called when the worker pool rejects a task while draining: the update stays unprocessed."""
+        with self.lock:
+            if update_id in self.in_flight:
+                self.dropped.add(update_id)
+
+    def dispatch_finished(self, update_id):
+        """Called once an update has been dispatched; updates no handler picked up are done immediately."""
+        with self.lock:
+            if self.in_flight.get(update_id) == 0:
+                del self.in_flight[update_id]
+                if update_id not in self.dropped:
+                    self._mark_processed(update_id)
+
+    def _mark_processed(self, update_id):
+        if update_id in self.seen:
+            return
+        if len(self.ring) == self.ring.maxlen:
+            self.seen.discard(self.ring[0]) # The deque drops this one on append
+        self.ring.append(update_id)
+        self.seen.add(update_id)
+
+    def safe_offset(self):
+        """Highest update_id such that it and every earlier update have been processed."""
+        with self.lock:
+            unfinished = self.in_flight.keys() | self.dropped
+            return min(unfinished) - 1 if unfinished else self.highest_received
+
+    def to_state(self):
+        offset = self.safe_offset()
+        with self.lock:
+            return {"last_update_id": offset, "recent_update_ids": list(self.ring)}
+
+processed_updates = ProcessedUpdateIndex(DEDUP_WINDOW, bot_state.get("last_update_id", 0), bot_state.get("recent_update_ids", []))
+
+def finish_current_update():
+    """Records the update handled on this thread as done, saving the update state if its handler changed a store."""
+    update_id = getattr(current_update, "update_id", None)
+    changed_store = getattr(current_update, "changed_store", False)
+    current_update.update_id = None
+    current_update.changed_store = False
+    if update_id is None:
+        return
+    processed_updates.task_done(update_id)
+    if changed_store:
+        with data_lock:
+            bot_state.update(processed_updates.to_state())
+            save_data(bot_state, STATE_FILE)
+
+def process_new_updates_once(updates):
+    """Wraps TeleBot.process_new_updates to skip updates that were already processed."""
+    # Called after every completed getUpdates, even when it returned nothing
+    record_successful_poll()
+    fresh_updates = []
+    for update in updates:
+        # Updates up to last_update_id were seen before in this run: fetched again behind a held-back offset
+        seen_before = update.update_id <= bot.last_update_id
+        bot.last_update_id = max(bot.last_update_id, update.update_id)
+        if processed_updates.is_duplicate(update.update_id):
+            if not seen_before:
+                print(f"Skipping already processed update {update.update_id}.")
+            continue
+        processed_updates.received(update.update_id)
+        # Tag the payload (message, callback query, ...) so the worker pool knows which update it belongs to
+        for payload in vars(update).values():
+            if hasattr(payload, "__dict__"):
+                payload.update_id = update.update_id
+        fresh_updates.append(update)
+    telebot.TeleBot.process_new_updates(bot, fresh_updates)
+    for update in fresh_updates:
+        processed_updates.dispatch_finished(update.update_id)
+
+bot.process_new_updates = process_new_updates_once
+
+# Highest update_id seen so far, for skip bookkeeping only; polls use processed_updates.safe_offset()
+bot.last_update_id = processed_updates.safe_offset()
+
+# --- Priority Update Scheduling ---
+# Search queries block on the upstream API, while menu buttons, commands, pagination and
+# admin actions are cheap. Updates are split into two priority classes so that a backlog
+# of searches never delays a /credits reply or an admin command.
+PRIORITY_FAST = 0
+PRIORITY_SEARCH = 1
+
+FAST_MENU_TEXTS = {"Check My Credits", "Buy Credit", "Contact Admin", "Referral System", "Main Menu", "Admin Panel"}
+SLOW_CALLBACKS = {"admin_view_users"} # One get_chat call per user
+
+def classify_update_priority(update, handlers=None):
+    """
+    Returns the priority class for an incoming update, based on the handler that will run it
+    (the first of handlers whose filters match, as in telebot) rather than on its sender.
+    """
+    if isinstance(update, CallbackQuery):
+        return PRIORITY_SEARCH if update.data in SLOW_CALLBACKS else PRIORITY_FAST
+    if not isinstance(update, telebot.types.Message):
+        return PRIORITY_FAST # Chat member updates
+    handler_function = next((handler["function"] for handler in handlers or bot.message_handlers
+                             if bot._test_message_handler(handler, update)), None)
+    if handler_function is admin_bulk_document:
+        return PRIORITY_SEARCH # CSV bulk upload: file download plus one store write per batch
+    if handler_function is handle_all_messages and update.content_type == "text" and update.text not in FAST_MENU_TEXTS:
+        return PRIORITY_SEARCH # A search, also for unknown "/..." texts and admin free text outside a flow
+    return PRIORITY_FAST # Commands, menu buttons, replies in a multi-step flow, short non-text replies
+
+class PriorityWorkerPool:
+    """
+    Drop-in replacement for telebot's worker pool with priority classes.
+    General workers always take the highest-priority task available, reserved workers
+    only take fast tasks, so fast paths keep capacity even when every general worker is searching.
+    """
+
+    def __init__(self, bot_instance, general_threads, reserved_threads):
+        self.telebot = bot_instance
+        self.condition = threading.Condition()
+        self.queues = {PRIORITY_FAST: deque(), PRIORITY_SEARCH: deque()}
+        self.exception_event = threading.Event()
+        self.exception_info = None
+        self.running = True
+        self.accepting = True
+        self.active = 0 # Tasks currently executing
+        self.workers = []
+        for i in range(general_threads):
+            self._start_worker(f"GeneralWorker{i + 1}", PRIORITY_SEARCH)
+        for i in range(reserved_threads):
+            self._start_worker(f"FastWorker{i + 1}", PRIORITY_FAST)
+
+    def _start_worker(self, name, lowest_priority):
+        worker = threading.Thread(target=self._worker_loop, args=(lowest_priority,), name=name, daemon=True)
+        worker.start()
+        self.workers.append(worker)
+
+    def put(self, func, *args, **kwargs):
+        """Queues a handler task in the priority class of the update it processes."""
+        priority = classify_update_priority(args[0], kwargs.get("handlers")) if args else PRIORITY_FAST
+        with self.condition:
+            update_id = getattr(args[0], "update_id", None) if args else None
+            if not self.accepting:
+                print("Worker pool is draining, dropping new update.")
+                if update_id is not None:
+                    processed_updates.task_dropped(update_id) # Keeps the saved offset below it, so it is redelivered
+                return
+            if update_id is not None:
+                processed_updates.task_queued(update_id)
+            self.queues[priority].append((func, args, kwargs))
+            # Wake everyone: a reserved worker cannot take a search task, so notify() alone could stall it
+            self.condition.notify_all()
+
+    def _next_task(self, lowest_priority):
+        """Blocks until a task this worker may run is queued. Returns None once the pool is closed."""
+        with self.condition:
+            while self.running:
+                for priority in range(PRIORITY_FAST, lowest_priority + 1):
+                    if self.queues[priority]:
+                        self.active += 1
+                        return self.queues[priority].popleft()
+                self.condition.wait()
+            return None
+
+    def _worker_loop(self, lowest_priority):
+        while True:
+            task = self._next_task(lowest_priority)
+            if task is None:
+                return
+            func, args, kwargs = task
+            update_id = getattr(args[0], "update_id", None) if args else None
+            current_update.update_id = update_id
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self.on_exception(e)
+            finally:
+                finish_current_update()
+                with self.condition:
+                    self.active -= 1
+                    self.condition.notify_all() # Wakes drain()
+
+    def on_exception(self, exc):
+        """Hands a handler exception to the bot's exception handler, or logs it."""
+        handled = self.telebot.exception_handler.handle(exc) if self.telebot.exception_handler else False
+        if not handled:
+            # Logged rather than raised in the polling loop: a failing handler is not a polling failure
+            print(f"Error in update handler: {str(exc).replace(str(bot_token), '<BOT_TOKEN>')}")
+
+    def raise_exceptions(self):
+        if self.exception_event.is_set():
+            raise self.exception_info
+
+    def clear_exceptions(self):
+        self.exception_event.clear()
+
+    def queue_depths(self):
+        """Returns the number of waiting tasks per priority class and the number of running tasks."""
+        with self.condition:
+            return {"fast": len(self.queues[PRIORITY_FAST]), "search": len(self.queues[PRIORITY_SEARCH]), "active": self.active}
+
+    def drain(self, timeout):
+        """
+        Stops accepting tasks and waits until queued and running tasks have finished.
+        Returns True if the pool drained within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.accepting = False
+            while self.active or any(self.queues.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """Stops the workers and waits up to timeout seconds (None: indefinitely) for running tasks to return."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for worker in self.workers:
+            if worker != threading.current_thread():
+                worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+# Replace telebot's default FIFO pool (2 threads shared by every update) with the priority pool
+bot.worker_pool.close()
+bot.worker_pool = PriorityWorkerPool(bot, GENERAL_WORKER_THREADS, FAST_WORKER_THREADS)
+
+# --- Job Scheduler ---
+class ScheduledJob:
+    """A delayed or periodic job registered with the TimerWheel. Pass it to TimerWheel.cancel() to cancel it."""
+
+    def __init__(self, func, args, kwargs, interval_ticks):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.interval_ticks = interval_ticks # None for one-shot jobs
+        self.deadline_tick = 0
+        self.cancelled = False
+
+class TimerWheel:
+    """
+    Hashed timing wheel that runs delayed one-shot and periodic jobs from a single timer thread.
+    Jobs are bucketed by the tick they are due on, so scheduling and cancelling are O(1).
+    Due jobs are handed to the executor (the worker pool), so a slow job never holds up the timer.
+    """
+
+    def __init__(self, executor, tick_seconds=0.1, slot_count=512):
+        self.executor = executor
+        self.tick_seconds = tick_seconds
+        self.slots = [set() for _ in range(slot_count)]
+        self.lock = threading.Lock()
+        self.current_tick = 0
+        self.started_at = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="TimerWheel", daemon=True)
+        self.thread.start()
+
+    def schedule(self, delay_seconds, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) once after delay_seconds."""
+        job = ScheduledJob(func, args, kwargs, None)
+        self._insert(job, self._ticks(delay_seconds))
+        return job
+
+    def schedule_every(self, interval_seconds, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) every interval_seconds, starting one interval from now."""
+        job = ScheduledJob(func, args, kwargs, self._ticks(interval_seconds))
+        self._insert(job, job.interval_ticks)
+        return job
+
+    def cancel(self, job):
+        """Cancels a job. Returns False if it was already cancelled or has already been handed to the executor."""
+        with self.lock:
+            if job.cancelled:
+                return False
+            job.cancelled = True
+            slot = self.slots[job.deadline_tick % len(self.slots)]
+            if job in slot:
+                slot.discard(job)
+                return True
+            return job.interval_ticks is not None # Periodic jobs are re-inserted unless cancelled
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _ticks(self, seconds):
+        return max(1, int(round(seconds / self.tick_seconds)))
+
+    def _insert(self, job, delay_ticks):
+        with self.lock:
+            if job.cancelled:
+                return
+            job.deadline_tick = self.current_tick + delay_ticks
+            # Jobs more than one revolution away share the slot and are skipped until their tick comes up
+            self.slots[job.deadline_tick % len(self.slots)].add(job)
+
+    def _run(self):
+        while True:
+            # Tick deadlines are absolute, so a late wake-up catches up instead of drifting
+            next_tick_at = self.started_at + (self.current_tick + 1) * self.tick_seconds
+            if self.stop_event.wait(max(0, next_tick_at - time.monotonic())):
+                return
+            with self.lock:
+                self.current_tick += 1
+                slot = self.slots[self.current_tick % len(self.slots)]
+                due = [job for job in slot if job.deadline_tick <= self.current_tick]
+                slot.difference_update(due)
+            for job in due:
+                if job.interval_ticks is not None:
+                    self._insert(job, job.interval_ticks)
+                self.executor(self._run_job, job)
+
+    @staticmethod
+    def _run_job(job):
+        if job.cancelled:
+            return
+        try:
+            job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            print(f"Scheduled job {getattr(job.func, '__name__', job.func)} failed: {e}")
+
+scheduler = TimerWheel(executor=bot.worker_pool.put)
+
+def sweep_expired_reports():
+    """Drops cached search results older than REPORT_TTL_SECONDS."""
+    cutoff = time.time() - REPORT_TTL_SECONDS
+    expired = [query_id for query_id, created_at in list(cash_report_times.items()) if created_at < cutoff]
+    for query_id in expired:
+        cash_reports.pop(query_id, None)
+        cash_report_times.pop(query_id, None)
+
+def sweep_expired_conversations():
+    """Ends multi-step flows whose TTL has passed."""
+    now = time.time()
+    expired = [chat_id for chat_id, entry in list(conversation_states.items()) if entry["expires_at"] <= now]
+    for chat_id in expired:
+        clear_conversation_state(chat_id)
+
+scheduler.schedule_every(CACHE_SWEEP_INTERVAL_SECONDS, sweep_expired_reports)
+scheduler.schedule_every(CACHE_SWEEP_INTERVAL_SECONDS, sweep_expired_conversations)
+scheduler.schedule_every(STATS_ROLLUP_INTERVAL_SECONDS, roll_up_stats)
+scheduler.schedule_every(AUDIT_FLUSH_INTERVAL_SECONDS, audit_log.flush)
+
 # --- Core Bot Logic Functions ---
 def check_group_membership(user_id, chat_id, bot_instance):
     """Checks if a user is a member of the specified Telegram group."""
@@ -163,7 +1036,7 @@ def generate_report(query, query_id):
     global url, api_token, limit, lang
     data = {"token": api_token, "request": query.split("\n")[0], "limit": limit, "lang": lang}
     try:
-        response = requests.post(url, json=data).json()
+        response = requests.post(url, json=data, timeout=SEARCH_TIMEOUT_SECONDS).json()
         if "Error code" in response:
             print("Error:" + response["Error code"])
             return None
@@ -195,6 +1068,7 @@ def generate_report(query, query_id):
         # This will be cleared on bot restart. For persistent reports, use Firestore.
         global cash_reports
         cash_reports[str(query_id)] = report_content
+        cash_report_times[str(query_id)] = time.time()
         return report_content
     except requests.exceptions.RequestException as e:
         print(f"Request error: {e}")
@@ -252,6 +1126,9 @@ def create_admin_panel_inline_keyboard():
     markup = InlineKeyboardMarkup(row_width=1)
     markup.add(
         InlineKeyboardButton(text="📊 View All Users", callback_data="admin_view_users"),
+        InlineKeyboardButton(text="📈 Stats", callback_data="admin_stats"),
+        InlineKeyboardButton(text="🏆 Referral Leaderboard", callback_data="admin_leaderboard"),
+        InlineKeyboardButton(text="📜 Audit Log", callback_data="admin_audit"),
         InlineKeyboardButton(text="➕➖ Manage Credits", callback_data="admin_manage_credits"),
         InlineKeyboardButton(text="🚫 Blacklist User", callback_data="admin_blacklist"),
         InlineKeyboardButton(text="✅ Unblacklist User", callback_data="admin_unblacklist"),
@@ -297,6 +1174,21 @@ def check_user_access(message):
     return True
 
 # --- Message Handlers ---
+# Registered first so a reply inside a multi-step flow is not treated as a search query.
+# Commands and menu buttons bypass the flow; an abandoned flow simply expires.
+@bot.message_handler(func=lambda message: message.content_type == "text"
+                     and not (message.text.startswith("/") or message.text in FAST_MENU_TEXTS)
+                     and get_conversation_state(message.chat.id) is not None)
+def handle_conversation_step(message):
+    """Routes a message to the step handler of the chat's active multi-step flow."""
+    entry = get_conversation_state(message.chat.id)
+    if entry is None:
+        return # Expired between the filter check and now
+    clear_conversation_state(message.chat.id)
+    step_handler = CONVERSATION_STEP_HANDLERS.get(entry["state"])
+    if step_handler:
+        step_handler(message)
+
 @bot.message_handler(commands=["start"])
 def send_welcome(message):
     """
@@ -445,6 +1337,29 @@ def check_credits(message):
         reply_markup=create_pricing_message_keyboard() # Offer to buy credits directly here
     )
 
+@bot.message_handler(commands=["leaderboard"])
+def show_leaderboard(message):
+    """Handles the /leaderboard command: top referrers and the user's own rank."""
+    if not check_user_access(message):
+        return
+
+    user_id = message.from_user.id
+    leaderboard_text = "🏆 *Top Referrers*\n\n"
+    entries = referral_leaderboard.top(LEADERBOARD_SIZE)
+    for rank, entry_user_id, referral_count in entries:
+        # Other users' IDs are partially hidden
+        display_id = "You" if entry_user_id == str(user_id) else f"•••{entry_user_id[-4:]}"
+        leaderboard_text += f"{rank}. {display_id} — *{referral_count}* referrals\n"
+    if not entries:
+        leaderboard_text += "No referrals yet. Be the first!\n"
+
+    rank, ranked_users = referral_leaderboard.rank(user_id)
+    if rank:
+        leaderboard_text += f"\n📍 Your rank: *{rank}* of {ranked_users}"
+    else:
+        leaderboard_text += "\n📍 You are not ranked yet. Share your referral link to join the leaderboard!"
+    bot.send_message(message.chat.id, leaderboard_text, parse_mode="Markdown")
+
 @bot.message_handler(commands=["admin"])
 @bot.message_handler(func=lambda message: message.text == "Admin Panel")
 def admin_panel(message):
@@ -549,8 +1464,10 @@ def admin_set_credits(message):
 
             target_user_data = get_user_data(target_user_id)
             if target_user_data:
+                old_credits = target_user_data.get("credits", 0)
                 target_user_data["credits"] = amount
                 set_user_data(target_user_id, target_user_data) # Save to JSON
+                audit_log.record(user_id, "set_credits", target_user_id, old_credits=old_credits, credits=amount)
                 bot.send_message(message.chat.id, f"Credits for user {target_user_id} set to {amount}.")
                 # Notify the target user if possible
                 try:
@@ -579,6 +1496,7 @@ def admin_blacklist_cmd(message):
         if len(parts) == 2:
             target_user_id = int(parts[1])
             blacklist_user(target_user_id) # Save to JSON
+            audit_log.record(user_id, "blacklist", target_user_id)
             bot.send_message(message.chat.id, f"User {target_user_id} has been blacklisted.")
             try:
                 bot.send_message(target_user_id, "You have been blacklisted and can no longer use this bot.")
@@ -604,6 +1522,7 @@ def admin_unblacklist_cmd(message):
         if len(parts) == 2:
             target_user_id = int(parts[1])
             unblacklist_user(target_user_id) # Save to JSON
+            audit_log.record(user_id, "unblacklist", target_user_id)
             bot.send_message(message.chat.id, f"User {target_user_id} has been unblacklisted.")
             try:
                 bot.send_message(target_user_id, "You have been unblacklisted and can now use this bot.")
@@ -616,6 +1535,130 @@ def admin_unblacklist_cmd(message):
     except Exception as e:
         bot.send_message(message.chat.id, f"An error occurred: {e}")
 
+# --- Bulk Admin Commands ---
+BULK_USAGE = (
+    "Bulk commands (IDs separated by spaces, commas or new lines):\n"
+    "`/bulk_set_credits <amount> <user_id> <user_id> ...`\n"
+    "`/bulk_blacklist <user_id> <user_id> ...`\n"
+    "`/bulk_unblacklist <user_id> <user_id> ...`\n\n"
+    "Or upload a CSV file with the command as caption. Rows are `user_id,amount` for "
+    "`/bulk_set_credits` (amount may be omitted if given in the caption) and `user_id` for the blacklist commands."
+)
+
+def run_bulk_command(message, command_line, rows):
+    """Applies a bulk command to the given rows and replies with a summary of applied and failed rows."""
+    parts = command_line.split()
+    command = parts[0]
+    if command == "/bulk_set_credits":
+        default_amount = parts[1] if len(parts) > 1 else None
+        applied, failed = bulk_set_credits(rows, default_amount)
+        action = "Credits updated"
+    elif command == "/bulk_blacklist":
+        applied, failed = bulk_set_blacklisted(rows, True)
+        action = "Blacklisted"
+    elif command == "/bulk_unblacklist":
+        applied, failed = bulk_set_blacklisted(rows, False)
+        action = "Unblacklisted"
+    else:
+        bot.send_message(message.chat.id, BULK_USAGE, parse_mode="Markdown")
+        return
+
+    audit_log.record(message.from_user.id, command.lstrip("/"), None, args=parts[1:],
+                     applied=applied, failed=len(failed))
+
+    # Users are not notified individually: hundreds of sends would hit Telegram's rate limits
+    summary = f"✅ {action}: {len(applied)}\n❌ Failed: {len(failed)}"
+    if failed:
+        summary += "\n\n" + "\n".join(f"{row}: {reason}" for row, reason in failed[:50])
+        if len(failed) > 50:
+            summary += f"\n... and {len(failed) - 50} more"
+    bot.send_message(message.chat.id, summary[:4000])
+
+@bot.message_handler(func=lambda message: message.content_type == "text" and message.text.startswith("/bulk_"))
+def admin_bulk_cmd(message):
+    """Admin bulk commands with the user IDs given inline."""
+    user_id = message.from_user.id
+    if not is_admin_user(user_id):
+        bot.send_message(message.chat.id, "You are not authorized to use this command.")
+        return
+
+    parts = message.text.split(maxsplit=1)
+    command = parts[0]
+    args = re.split(r"[\s,]+", parts[1].strip()) if len(parts) > 1 else []
+    if command == "/bulk_set_credits":
+        if len(args) < 2:
+            bot.send_message(message.chat.id, BULK_USAGE, parse_mode="Markdown")
+            return
+        command = f"{command} {args[0]}"
+        args = args[1:]
+    if not args:
+        bot.send_message(message.chat.id, BULK_USAGE, parse_mode="Markdown")
+        return
+    try:
+        run_bulk_command(message, command, [[arg] for arg in args])
+    except Exception as e:
+        bot.send_message(message.chat.id, f"An error occurred: {e}")
+
+@bot.message_handler(content_types=["document"], func=lambda message: (message.caption or "").startswith("/bulk_"))
+def admin_bulk_document(message):
+    """Admin bulk commands with the rows given as an uploaded CSV document."""
+    user_id = message.from_user.id
+    if not is_admin_user(user_id):
+        bot.send_message(message.chat.id, "You are not authorized to use this command.")
+        return
+
+    try:
+        file_info = bot.get_file(message.document.file_id)
+        content = bot.download_file(file_info.file_path).decode("utf-8-sig")
+        rows = parse_bulk_rows(content)
+        if not rows:
+            bot.send_message(message.chat.id, "The uploaded file contains no rows.")
+            return
+        run_bulk_command(message, message.caption, rows)
+    except UnicodeDecodeError:
+        bot.send_message(message.chat.id, "The uploaded file must be a UTF-8 encoded CSV file.")
+    except Exception as e:
+        bot.send_message(message.chat.id, f"An error occurred: {e}")
+
+# --- Admin Audit Log Viewer ---
+def render_audit_page(page_number):
+    """Returns (text, markup) for a page of the audit log, newest entries first."""
+    entries, page_number, page_count = audit_log.page(page_number, AUDIT_PAGE_SIZE)
+    audit_text = f"📜 Admin Audit Log (page {page_number}/{page_count})\n\n"
+    for entry in entries:
+        details = {key: value for key, value in entry.items() if key not in ("time", "admin_id", "action", "target")}
+        line = f"{entry['time']} | admin {entry['admin_id']} | {entry['action']}"
+        if entry.get("target") is not None:
+            line += f" → {entry['target']}"
+        if details:
+            line += f" {json.dumps(details, ensure_ascii=False)[:300]}"
+        audit_text += line + "\n\n"
+    if not entries:
+        audit_text += "No admin actions recorded yet."
+
+    markup = InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if page_number > 1:
+        buttons.append(InlineKeyboardButton(text="⬅️ Newer", callback_data=f"admin_audit {page_number - 1}"))
+    if page_number < page_count:
+        buttons.append(InlineKeyboardButton(text="Older ➡️", callback_data=f"admin_audit {page_number + 1}"))
+    if buttons:
+        markup.add(*buttons)
+    return audit_text[:4000], markup
+
+@bot.message_handler(func=lambda message: message.content_type == "text" and message.text.startswith("/audit"))
+def admin_audit_cmd(message):
+    """Admin command to page through recent admin actions: /audit [page]."""
+    user_id = message.from_user.id
+    if not is_admin_user(user_id):
+        bot.send_message(message.chat.id, "You are not authorized to use this command.")
+        return
+
+    parts = message.text.split()
+    page_number = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 1
+    audit_text, markup = render_audit_page(page_number)
+    bot.send_message(message.chat.id, audit_text, reply_markup=markup) # Plain text: entries contain underscores
+
 # --- Admin Add Admin Handler ---
 @bot.callback_query_handler(func=lambda call: call.data == "admin_add_admin")
 def admin_add_admin_callback(call: CallbackQuery):
@@ -626,8 +1669,8 @@ def admin_add_admin_callback(call: CallbackQuery):
 
     bot.send_message(call.message.chat.id, "Please send the User ID of the person you want to add as an admin.")
     bot.answer_callback_query(call.id)
-    # Register the next step to process the user ID
-    bot.register_next_step_handler(call.message, process_add_admin_step)
+    # Wait for the user ID as the next message in this chat
+    set_conversation_state(call.message.chat.id, "awaiting_new_admin_id")
 
 def process_add_admin_step(message):
     user_id = message.from_user.id
@@ -640,6 +1683,7 @@ def process_add_admin_step(message):
         if new_admin_id == ADMIN_USER_ID or new_admin_id in additional_admins:
             bot.send_message(message.chat.id, f"User `{new_admin_id}` is already an admin.", parse_mode="Markdown")
         elif add_admin(new_admin_id):
+            audit_log.record(user_id, "add_admin", new_admin_id)
             bot.send_message(message.chat.id, f"User `{new_admin_id}` has been added as an admin.", parse_mode="Markdown")
             try:
                 bot.send_message(new_admin_id, "🎉 You have been granted admin access to the bot!")
@@ -652,6 +1696,11 @@ def process_add_admin_step(message):
     except Exception as e:
         bot.send_message(message.chat.id, f"An error occurred: {e}")
 
+# Conversation state name -> handler for the next message in that flow
+CONVERSATION_STEP_HANDLERS = {
+    "awaiting_new_admin_id": process_add_admin_step,
+}
+
 # --- Handle chat_member_updated for automatic bot start after group join ---
 @bot.chat_member_handler()
 def chat_member_updates(message: telebot.types.ChatMemberUpdated):
@@ -671,62 +1720,44 @@ def chat_member_updates(message: telebot.types.ChatMemberUpdated):
         if old_status in ['left', 'kicked'] and new_status in ['member', 'administrator', 'creator', 'restricted']:
             print(f"DEBUG: User {user_id} ({message.new_chat_member.user.first_name}) explicitly joined/rejoined group {GROUP_ID}. Simulating /start.")
             # Added a small delay to potentially allow Telegram's state to propagate
-            time.sleep(0.5)
-            try:
-                # Re-check the chat member status after a small delay
-                updated_chat_member = bot.get_chat_member(GROUP_ID, user_id)
-                if updated_chat_member.status in ['member', 'administrator', 'creator', 'restricted']:
-                    dummy_message = telebot.types.Message.de_json({
-                        "message_id": int(time.time()),
-                        "from": message.new_chat_member.user.to_dict(),
-                        "chat": { # Corrected: Use a dictionary for chat properties
-                            "id": message.new_chat_member.user.id,
-                            "type": "private", # Assuming this is always a private chat with the bot
-                            "first_name": message.new_chat_member.user.first_name,
-                            "last_name": message.new_chat_member.user.last_name,
-                            "username": message.new_chat_member.user.username
-                        },
-                        "date": int(time.time()),
-                        "text": "/start"
-                    })
-                    send_welcome(dummy_message)
-                    print(f"DEBUG: send_welcome successfully called for user {user_id} after verified group join.")
-                else:
-                    print(f"DEBUG: User {user_id} was not confirmed as a member after delay. Status: {updated_chat_member.status}")
-            except Exception as e:
-                print(f"ERROR: Failed to re-check chat member status or send welcome message: {e}")
+            scheduler.schedule(0.5, welcome_verified_group_member, message, "group join")
         elif old_status not in ['member', 'administrator', 'creator', 'restricted'] and \
              new_status in ['member', 'administrator', 'creator', 'restricted']:
             # This handles the initial join where old_status might not be 'left'/'kicked' (e.g., brand new user)
             print(f"DEBUG: User {user_id} ({message.new_chat_member.user.first_name}) transitioned to member status in group {GROUP_ID}. Simulating /start.")
-            time.sleep(0.5)
-            try:
-                updated_chat_member = bot.get_chat_member(GROUP_ID, user_id)
-                if updated_chat_member.status in ['member', 'administrator', 'creator', 'restricted']:
-                    dummy_message = telebot.types.Message.de_json({
-                        "message_id": int(time.time()),
-                        "from": message.new_chat_member.user.to_dict(),
-                        "chat": { # Corrected: Use a dictionary for chat properties
-                            "id": message.new_chat_member.user.id,
-                            "type": "private", # Assuming this is always a private chat with the bot
-                            "first_name": message.new_chat_member.user.first_name,
-                            "last_name": message.new_chat_member.user.last_name,
-                            "username": message.new_chat_member.user.username
-                        },
-                        "date": int(time.time()),
-                        "text": "/start"
-                    })
-                    send_welcome(dummy_message)
-                    print(f"DEBUG: send_welcome successfully called for user {user_id} after verified initial join.")
-                else:
-                    print(f"DEBUG: User {user_id} was not confirmed as a member after delay on initial join. Status: {updated_chat_member.status}")
-            except Exception as e:
-                print(f"ERROR: Failed to re-check chat member status or send welcome message on initial join: {e}")
+            scheduler.schedule(0.5, welcome_verified_group_member, message, "initial join")
         else:
             print(f"DEBUG: chat_member_updates for user {user_id} in GROUP_ID {GROUP_ID} was not a valid join event (old: {old_status}, new: {new_status}).")
     else:
         print(f"DEBUG: chat_member_updates for a different chat_id {chat_id} (not configured GROUP_ID {GROUP_ID}).")
 
+def welcome_verified_group_member(message: telebot.types.ChatMemberUpdated, join_kind):
+    """Scheduled shortly after a group join: re-checks membership and simulates /start for the new member."""
+    user_id = message.from_user.id
+    try:
+        # Re-check the chat member status after a small delay
+        updated_chat_member = bot.get_chat_member(GROUP_ID, user_id)
+        if updated_chat_member.status in ['member', 'administrator', 'creator', 'restricted']:
+            dummy_message = telebot.types.Message.de_json({
+                "message_id": int(time.time()),
+                "from": message.new_chat_member.user.to_dict(),
+                "chat": { # Corrected: Use a dictionary for chat properties
+                    "id": message.new_chat_member.user.id,
+                    "type": "private", # Assuming this is always a private chat with the bot
+                    "first_name": message.new_chat_member.user.first_name,
+                    "last_name": message.new_chat_member.user.last_name,
+                    "username": message.new_chat_member.user.username
+                },
+                "date": int(time.time()),
+                "text": "/start"
+            })
+            send_welcome(dummy_message)
+            print(f"DEBUG: send_welcome successfully called for user {user_id} after verified {join_kind}.")
+        else:
+            print(f"DEBUG: User {user_id} was not confirmed as a member after delay on {join_kind}. Status: {updated_chat_member.status}")
+    except Exception as e:
+        print(f"ERROR: Failed to re-check chat member status or send welcome message on {join_kind}: {e}")
+
 
 @bot.message_handler(func=lambda message: True)
 def handle_all_messages(message):
@@ -762,15 +1793,16 @@ def handle_all_messages(message):
             return
         elif message.text.startswith("/set_credits") or \
              message.text.startswith("/blacklist") or \
-             message.text.startswith("/unblacklist"):
+             message.text.startswith("/unblacklist") or \
+             message.text.startswith("/bulk_") or \
+             message.text.startswith("/audit"):
             # These are handled by their specific handlers, this prevents credit deduction
             pass
         else:
             # Process as a search query
             user_data = get_user_data(user_id)
-            credits = user_data.get("credits", 0) if user_data else 0
 
-            if credits <= 0:
+            if user_data is None or not charge_search_credit(user_id, user_data):
                 bot.send_message(
                     message.chat.id,
                     "🚫 You have no credits left. Please buy more to continue searching.",
@@ -778,9 +1810,6 @@ def handle_all_messages(message):
                 )
                 return
 
-            user_data["credits"] -= 1 # Deduct credit
-            set_user_data(user_id, user_data) # Save updated credits to JSON
-
             bot.send_message(
                 message.chat.id,
                 f"Searching for '{message.text.splitlines()[0]}'...\n"
@@ -795,8 +1824,7 @@ def handle_all_messages(message):
             if report is None:
                 bot.reply_to(message, "The bot is unable to process your request at the moment. Please try again later.")
                 # Add back the deducted credit for API errors
-                user_data["credits"] += 1
-                set_user_data(user_id, user_data)
+                refund_search_credit(user_id, user_data)
                 bot.send_message(message.chat.id, f"Your credit has been refunded due to a processing error. Current credits: *{user_data['credits']}*", parse_mode="Markdown")
 
                 markup_after_result = InlineKeyboardMarkup()
@@ -807,8 +1835,7 @@ def handle_all_messages(message):
             elif report == ["No results found"]:
                 bot.reply_to(message, "😔 No results found for your query.")
                 # Refund credit if no results are found
-                user_data["credits"] += 1
-                set_user_data(user_id, user_data)
+                refund_search_credit(user_id, user_data)
                 bot.send_message(message.chat.id, f"Your credit has been refunded as no results were found. Current credits: *{user_data['credits']}*", parse_mode="Markdown")
 
                 markup_after_result = InlineKeyboardMarkup()
@@ -872,13 +1899,7 @@ def callback_query(call: CallbackQuery):
         )
         markup = create_pricing_message_keyboard()
         markup.add(InlineKeyboardButton(text="⬅️ Back to Main Menu", callback_data="back_to_main_menu")) # Add back button here
-        bot.send_message(
-            call.message.chat.id,
-            pricing_text,
-            parse_mode="Markdown",
-            reply_markup=markup
-        )
-        bot.answer_callback_query(call.id) # Acknowledge the callback
+        answer_and_send(call, pricing_text, parse_mode="Markdown", reply_markup=markup)
 
     elif call.data == "verify_group_membership":
         # Simulate a /start command when the "Verify" button is pressed
@@ -1049,33 +2070,223 @@ def callback_query(call: CallbackQuery):
                 bot.send_message(call.message.chat.id, user_list_text, parse_mode="Markdown")
             bot.answer_callback_query(call.id, "Users list generated.")
 
-        elif action == "manage_credits":
-            bot.send_message(call.message.chat.id, "To set credits, send: `/set_credits <user_id> <amount>`\n"
-                                                  "Example: `/set_credits 123456789 10`", parse_mode="Markdown")
+        elif action == "stats":
+            stats = get_stats_summary()
+            stats_text = (
+                "📈 *Bot Statistics*\n\n"
+                f"👥 *Total users*: {stats['total_users']}\n"
+                f"🆕 *New users today*: {stats['new_users_today']}\n"
+                f"💰 *Outstanding credits*: {stats['outstanding_credits']}\n"
+                f"🔍 *Credits spent*: {stats['credits_spent']} (today: {stats['credits_spent_today']})\n"
+                f"↩️ *Credits refunded*: {stats['credits_refunded']} (today: {stats['credits_refunded_today']})\n"
+                f"📉 *Refund ratio*: {stats['refund_ratio']:.1%}\n"
+                f"🚫 *Blacklisted*: {stats['blacklisted']}\n"
+                f"🤝 *Total referrals*: {stats['total_referrals']} (today: {stats['referrals_today']})"
+            )
+            answer_and_send(call, stats_text, parse_mode="Markdown")
+
+        elif action == "leaderboard":
+            entries = referral_leaderboard.top(ADMIN_LEADERBOARD_SIZE)
+            leaderboard_text = f"🏆 *Referral Leaderboard* (top {ADMIN_LEADERBOARD_SIZE})\n\n"
+            for rank, entry_user_id, referral_count in entries:
+                leaderboard_text += f"{rank}. `{entry_user_id}` — {referral_count} referrals\n"
+            if not entries:
+                leaderboard_text += "No referrals yet."
+            answer_and_send(call, leaderboard_text, parse_mode="Markdown")
+
+        elif action == "audit":
+            audit_text, markup = render_audit_page(1)
+            answer_and_send(call, audit_text, reply_markup=markup)
+
+        elif action.startswith("audit "):
+            # Newer/Older buttons edit the audit message in place
+            audit_text, markup = render_audit_page(int(action.split()[1]))
+            bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, text=audit_text, reply_markup=markup)
             bot.answer_callback_query(call.id)
 
+        elif action == "manage_credits":
+            answer_and_send(call, "To set credits, send: `/set_credits <user_id> <amount>`\n"
+                            "Example: `/set_credits 123456789 10`\n\n" + BULK_USAGE, parse_mode="Markdown")
+
         elif action == "blacklist":
-            bot.send_message(call.message.chat.id, "To blacklist a user, send: `/blacklist <user_id>`\n"
-                                                  "Example: `/blacklist 987654321`", parse_mode="Markdown")
-            bot.answer_callback_query(call.id)
+            answer_and_send(call, "To blacklist a user, send: `/blacklist <user_id>`\n"
+                            "Example: `/blacklist 987654321`\n\n" + BULK_USAGE, parse_mode="Markdown")
 
         elif action == "unblacklist":
-            bot.send_message(call.message.chat.id, "To unblacklist a user, send: `/unblacklist <user_id>`\n"
-                                                  "Example: `/unblacklist 987654321`", parse_mode="Markdown")
-            bot.answer_callback_query(call.id)
+            answer_and_send(call, "To unblacklist a user, send: `/unblacklist <user_id>`\n"
+                            "Example: `/unblacklist 987654321`\n\n" + BULK_USAGE, parse_mode="Markdown")
 
     else:
         bot.answer_callback_query(call.id, "Unknown action.")
 
 
-# --- Bot Polling ---
-print("Bot polling started...")
-while True:
+# --- Lifecycle Management ---
+shutdown_event = threading.Event()
+shutdown_started_at = None
+
+def request_shutdown(signum, frame):
+    """Signal handler: stops polling; the main loop then drains and flushes before exiting."""
+    global shutdown_started_at
+    if shutdown_event.is_set():
+        return
+    print(f"Received signal {signum}. Stopping polling and shutting down gracefully...")
+    shutdown_started_at = time.monotonic()
+    shutdown_event.set() # The supervisor stops polling without waiting for the current long poll
+
+def shutdown():
+    """Drains in-flight handlers, flushes the stores and records the last processed update offset."""
+    started_at = shutdown_started_at or time.monotonic()
+    scheduler.stop()
+    remaining = max(0, SHUTDOWN_DRAIN_SECONDS - (time.monotonic() - started_at))
+    # Handlers send their replies synchronously, so draining them also drains outbound messages
+    drained = bot.worker_pool.drain(remaining)
+    if drained:
+        print("All in-flight updates processed.")
+    else:
+        print(f"Drain deadline of {SHUTDOWN_DRAIN_SECONDS}s exceeded; unfinished updates will be redelivered and run again.")
+
+    # Also records the safe offset: unfinished updates stay above it and are redelivered on the next start
+    flush_data()
+    audit_log.flush()
+    print(f"Data flushed. Last processed update offset: {bot_state.get('last_update_id', 0)}")
+    # Workers still stuck in a handler are daemon threads; don't wait for them past the drain deadline
+    bot.worker_pool.close(timeout=None if drained else 0)
+
+signal.signal(signal.SIGTERM, request_shutdown)
+signal.signal(signal.SIGINT, request_shutdown)
+
+# --- Polling Supervisor ---
+# The supervisor drives getUpdates itself instead of using bot.polling(none_stop=True), which retries
+# API errors internally (fixed backoff up to 60s on the polling thread) so they never reach the supervisor.
+poll_health = {
+    "state": "starting", # starting | polling | backoff | stopping
+    "polling_since": None, # Start of the current poll attempt
+    "last_poll_at": None, # Time of the last successful getUpdates call
+    "last_attempt_at": None, # Time the last getUpdates call returned, successfully or not
+    "consecutive_failures": 0,
+    "last_error": None,
+    "backoff_seconds": 0,
+    "watchdog_restarts": 0,
+    "attempt": 0, # Number of the current poll attempt; abandoned attempts must not dispatch updates
+}
+
+def record_successful_poll():
+    poll_health["last_poll_at"] = time.time()
+    poll_health["consecutive_failures"] = 0
+
+def poll_backoff_seconds(failures):
+    """Exponential backoff with equal jitter: half the capped delay is fixed, the other half random."""
+    delay = min(POLL_BACKOFF_MAX_SECONDS, POLL_BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+    return delay / 2 + uniform(0, delay / 2)
+
+def seconds_since_last_poll():
+    """Seconds since polling last made progress (a poll attempt returning, or starting a new attempt)."""
+    last_progress = max(poll_health["last_attempt_at"] or 0, poll_health["polling_since"] or 0)
+    return time.time() - last_progress
+
+def poll_once(attempt, outcome, done):
+    """Polling thread: one getUpdates call, then dispatch of the updates it returned."""
     try:
-        # Use none_stop=True to keep polling even if updates are not coming in.
-        # Use interval=0 for immediate processing of updates.
-        bot.polling(none_stop=True, interval=0)
+        # timeout is the connect timeout here; telebot sets the read timeout to long_polling_timeout + 5
+        # Confirms only updates that have been fully processed; unfinished ones are delivered again
+        updates = bot.get_updates(offset=processed_updates.safe_offset() + 1, timeout=API_CONNECT_TIMEOUT,
+                                  long_polling_timeout=POLL_TIMEOUT)
+        held_back_only = bool(updates) and all(update.update_id <= bot.last_update_id for update in updates)
+        # Updates fetched after shutdown or by an abandoned attempt stay unconfirmed and are delivered again
+        if attempt == poll_health["attempt"] and not shutdown_event.is_set():
+            bot.process_new_updates(updates)
+        if held_back_only:
+            # getUpdates returns at once while a slow handler holds the offset back; don't spin on it
+            shutdown_event.wait(HELD_BACK_POLL_INTERVAL_SECONDS)
     except Exception as e:
-        print(f"Bot polling error: {e}")
-        # Implement exponential backoff for retries
-        time.sleep(5) # Wait before retrying to prevent rapid error loops
\ No newline at end of file
+        outcome["error"] = e
+    finally:
+        poll_health["last_attempt_at"] = time.time()
+        if attempt == poll_health["attempt"]:
+            poll_health["watchdog_restarts"] = 0 # Polls return again, even if with errors
+        done.set()
+
+def run_poll_attempt():
+    """
+    Runs one poll attempt on a polling thread. Returns the exception it failed with, or None.
+    Returns early on shutdown, and abandons an attempt stalled for WATCHDOG_STALL_SECONDS.
+    """
+    poll_health["attempt"] += 1
+    poll_health["state"] = "polling"
+    poll_health["polling_since"] = time.time()
+    outcome, done = {}, threading.Event()
+    threading.Thread(target=poll_once, args=(poll_health["attempt"], outcome, done), name="PollingThread", daemon=True).start()
+    while not done.wait(1):
+        if shutdown_event.is_set():
+            return None
+        if seconds_since_last_poll() >= WATCHDOG_STALL_SECONDS:
+            check_poller_liveness()
+            return None
+    return outcome.get("error")
+
+def check_poller_liveness():
+    """Watchdog: abandons a poll attempt that stopped returning, and exits if a fresh attempt stalls too."""
+    if poll_health["watchdog_restarts"] == 0:
+        print(f"WATCHDOG: poll attempt has not returned for {seconds_since_last_poll():.0f}s. Restarting polling.")
+        poll_health["watchdog_restarts"] += 1
+    else:
+        print("WATCHDOG: polling is still stalled after a restart. Shutting down so the platform restarts the bot.")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+class HealthRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET /health (liveness) and GET /ready (readiness) as JSON."""
+
+    def do_GET(self):
+        stalled = poll_health["state"] == "polling" and seconds_since_last_poll() >= WATCHDOG_STALL_SECONDS
+        recently_polled = poll_health["last_poll_at"] is not None and \
+            time.time() - poll_health["last_poll_at"] < POLL_TIMEOUT * 3
+        if self.path == "/health":
+            ok = not stalled
+        elif self.path == "/ready":
+            ok = poll_health["state"] == "polling" and recently_polled and not shutdown_event.is_set()
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps({
+            "ok": ok,
+            "state": poll_health["state"],
+            "last_successful_poll": poll_health["last_poll_at"],
+            "seconds_since_last_poll": round(time.time() - poll_health["last_poll_at"], 1) if poll_health["last_poll_at"] else None,
+            "consecutive_failures": poll_health["consecutive_failures"],
+            "backoff_seconds": round(poll_health["backoff_seconds"], 1),
+            "last_error": poll_health["last_error"],
+            "queue_depths": bot.worker_pool.queue_depths(),
+        }).encode("utf-8")
+        self.send_response(200 if ok else 503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Health checks would flood the logs
+
+if HEALTH_PORT:
+    try:
+        health_server = ThreadingHTTPServer((HEALTH_HOST, HEALTH_PORT), HealthRequestHandler)
+        threading.Thread(target=health_server.serve_forever, name="HealthServer", daemon=True).start()
+        print(f"Health endpoint listening on http://{HEALTH_HOST}:{HEALTH_PORT}/health")
+    except OSError as e:
+        print(f"Could not start health endpoint on {HEALTH_HOST}:{HEALTH_PORT}: {e}")
+
+# --- Bot Polling ---
+print("Bot polling started...")
+while not shutdown_event.is_set():
+    error = run_poll_attempt()
+    if error is None:
+        continue
+    poll_health["consecutive_failures"] += 1
+    poll_health["last_error"] = str(error).replace(str(bot_token), "<BOT_TOKEN>") # Served by /health, never expose the token
+    poll_health["backoff_seconds"] = poll_backoff_seconds(poll_health["consecutive_failures"])
+    poll_health["state"] = "backoff"
+    print(f"Bot polling error ({poll_health['consecutive_failures']} in a row): {poll_health['last_error']}. "
+          f"Retrying in {poll_health['backoff_seconds']:.1f}s.")
+    shutdown_event.wait(poll_health["backoff_seconds"]) # Returns early on shutdown
+poll_health["state"] = "stopping"
+shutdown()
+print("Bot stopped.")
\ No newline at end of file